@@ -15,7 +15,6 @@ in the N input files.
 from swissknife.error import AppError
 from swissknife.utils import (
     first,
-    flatten,
     last,
     lenient_float,
     main_func,
@@ -27,11 +26,14 @@ from swissknife.utils import (
     only_numbers,
     open_anything,
     parse_index_specification,
-    sublist,
+    sublist_getter,
 )
 
+from concurrent.futures import ThreadPoolExecutor
 from itertools import cycle, islice
+import numpy as np
 import optparse
+import os
 import sys
 
 # Known aggregator functions
@@ -54,14 +56,58 @@ mean_err.argout = ("", "err")
 mean_sd.argout = ("", "sd")
 
 
+def vectorized_mean_sd(data, axis=0):
+    """Vectorized counterpart of `mean_sd()`; returns the means and the
+    standard deviations of the given NumPy array along the given axis."""
+    n = data.shape[axis]
+    mean = data.mean(axis=axis)
+    if n < 2:
+        return mean, np.zeros_like(mean)
+
+    # Reuse the means calculated above instead of letting np.std() calculate
+    # them again. np.einsum() squares and sums the deviations in a single
+    # pass, without an intermediate array for the squares
+    deviations = np.moveaxis(data, axis, 0) - mean
+    sum_sq = np.einsum("i...,i...->...", deviations, deviations)
+    return mean, np.sqrt(sum_sq / (n - 1))
+
+
+def vectorized_mean_err(data, axis=0):
+    """Vectorized counterpart of `mean_err()`; returns the means and the
+    estimates for the errors of the means of the given NumPy array along
+    the given axis."""
+    mean, sd = vectorized_mean_sd(data, axis)
+    return mean, sd / (data.shape[axis] ** 0.5)
+
+
+def vectorized_mean_95ci(data, axis=0):
+    """Vectorized counterpart of `mean_95ci()`; returns the means and the
+    estimates for the widths of the 95% confidence intervals of the means
+    of the given NumPy array along the given axis."""
+    mean, sd = vectorized_mean_sd(data, axis)
+    return mean, sd / (data.shape[axis] ** 0.5) * 3.919927969
+
+
+# Vectorized counterparts of the known aggregator functions. Each of these
+# reduces a NumPy array along a given axis in a single call. Functions
+# with multiple return values return a tuple of arrays.
+vectorized_functions = {
+    max: np.max,
+    mean: np.mean,
+    mean_sd: vectorized_mean_sd,
+    mean_err: vectorized_mean_err,
+    mean_95ci: vectorized_mean_95ci,
+    median: np.median,
+    min: np.min,
+    sum: np.sum,
+    first: lambda data, axis=0: data.take(0, axis=axis),
+    last: lambda data, axis=0: data.take(-1, axis=axis),
+}
+
+
 def create_option_parser():
     """Creates an `OptionParser` that parses the command line
     options."""
-    global functions
-
-    def function_callback(option, opt_str, value, parser):
-        global functions
-        setattr(parser.values, option.dest, functions[value])
 
     def indexspec_callback(option, opt_str, value, parser):
         setattr(parser.values, option.dest, parse_index_specification(value))
@@ -100,10 +146,8 @@ def create_option_parser():
         "--function",
         metavar="FUNCTION",
         dest="function",
-        default=mean,
-        action="callback",
-        type="str",
-        callback=function_callback,
+        default="mean",
+        choices=sorted(functions.keys()),
         help="use the given FUNCTION to aggregate the values. "
         "Possible values are: %s." % ", ".join(sorted(functions.keys())),
     )
@@ -128,83 +172,203 @@ def create_option_parser():
     return parser
 
 
-def process_files_column(infiles, options):
-    """Processes the given files in ``column`` mode.
-    
-    Files will be processed sequentially. The output is a single line for
-    each file where column i contains the result of the aggregation function
-    for the column of the file.
-    """
-    for idx, filename in enumerate(infiles):
-        process_files_column_single(open_anything(filename), options, idx == 0)
+def can_pass_headers_through(options):
+    """Returns whether the header rows of the input files can be printed
+    verbatim, i.e. whether splitting and re-joining them would yield the
+    same rows anyway."""
+    return (
+        not options.fields
+        and not hasattr(options.function, "argout")
+        and options.in_delimiter == options.out_delimiter
+    )
 
 
-def process_files_column_single(fp, options, first_file=False):
-    """Processes the given stream (open file) in ``column`` mode."""
+def load_table(fp, options, strip=True, raw_headers=False):
+    """Loads a table in tabular format from the given stream.
 
+    Rows preceding the first row that contains numbers only (in the columns
+    we are interested in) are considered to be headers. The remaining rows
+    are handed over to NumPy in one go, which is considerably faster than
+    converting the cells one by one. `strip` specifies whether to strip
+    all leading and trailing whitespace from lines or only the line
+    terminators.
+
+    Returns a tuple containing the list of header rows and the data as a
+    two-dimensional NumPy array. Each header row is a list of strings, or
+    the stripped line itself if `raw_headers` is ``True``. When the rows have
+    different lengths, the data is returned as a list of rows instead, each
+    row being a list of floats."""
     # Calculate the column indices we are interested in
     if options.fields:
         col_idxs = [f - 1 for f in options.fields]
+        select_columns = sublist_getter(col_idxs)
     else:
         col_idxs = None
 
-    # Some caching to avoid costly lookups
     delim = options.in_delimiter
-    fields = options.fields
-    func = options.function
-    join = options.out_delimiter.join
-
-    # Set up characters to strip from lines
-    chars_to_strip = " \t\r\n" if options.strip else "\r\n"
 
-    # Flag to denote whether we have seen at least one row with numbers.
-    # If not, we are still processing the headers.
-    data_started = False
-    result = []
+    # Set up the function that strips the lines. Line terminators need to be
+    # removed from the end of the line only
+    if strip:
+        strip_line = str.strip
+    else:
+        strip_line = lambda line: line.rstrip("\r\n")
 
+    # Collect the headers until we see the first row with numbers only
+    headers = []
     for line in fp:
         # Split the input line
-        line = line.strip(chars_to_strip).split(delim)
+        line = strip_line(line)
+        parts = line.split(delim)
 
         # Select the relevant columns only
         if col_idxs:
-            line = sublist(line, col_idxs)
-
-        if not data_started:
-            # Check whether this row contains numbers only (at least in the
-            # columns we are interested in)
-            if not only_numbers(line):
-                # This is a header, print it if we are in the first file, assuming
-                # that the remaining files contain the same header
-                if first_file:
-                    if hasattr(func, "argout"):
-                        headers = []
-                        for header in line:
-                            headers.extend(
-                                "%s_%s" % (header, arg) if arg else header
-                                for arg in func.argout
-                            )
-                    else:
-                        headers = line
-                    print(join(headers))
-                continue
-            else:
-                # Yay, finally real data!
-                data_started = True
-
-        # Convert the columns of interest to floats
-        line = [float(x) for x in line]
-        if len(result) < len(line):
-            diff = len(line) - len(result)
-            if not result:
-                result = [[] for _ in range(diff)]
-            else:
-                result.extend([0.0] for _ in range(diff))
-        for item, l in zip(line, result):
-            l.append(item)
+            parts = select_columns(parts)
+
+        if only_numbers(parts):
+            # Yay, finally real data!
+            break
+
+        headers.append(line if raw_headers else parts)
+    else:
+        # No data at all
+        return headers, np.empty((0, 0))
+
+    # The lines are kept in memory so we can parse them again row by row if
+    # NumPy cannot handle them
+    lines = [line]
+    lines.extend(fp)
+
+    if len(delim) == 1:
+        # NumPy takes care of the line terminators itself so the remaining
+        # lines need to be stripped only if we have to strip whitespace. It
+        # cannot handle rows of different lengths, though
+        try:
+            data = np.loadtxt(
+                [line.strip() for line in lines] if strip else lines,
+                delimiter=delim,
+                usecols=col_idxs,
+                comments=None,
+                ndmin=2,
+            )
+            return headers, data
+        except ValueError:
+            pass
+
+    # Parse the lines row by row; this also works for multi-character
+    # delimiters and for rows of different lengths
+    rows = []
+    for line in lines:
+        line = strip_line(line)
+        if not line:
+            continue
+
+        parts = line.split(delim)
+        if col_idxs:
+            parts = select_columns(parts)
+        rows.append([float(x) for x in parts])
+
+    if not rows:
+        return headers, np.empty((0, 0))
+    if any(len(row) != len(rows[0]) for row in rows):
+        return headers, rows
+    return headers, np.array(rows)
+
+
+def expand_headers(headers, func):
+    """Expands the given list of column headers for the given aggregation
+    function. Functions with multiple return values will get one column
+    for each return value."""
+    if not hasattr(func, "argout"):
+        return headers
+
+    result = []
+    for header in headers:
+        result.extend(f"{header}_{arg}" if arg else header for arg in func.argout)
+    return result
+
+
+def reduce_table(data, func):
+    """Reduces the given NumPy array along its first axis using the
+    vectorized counterpart of the given aggregation function.
+
+    Returns a NumPy array with one dimension less than `data`. Functions with
+    multiple return values will have their results interleaved along the
+    last axis."""
+    if not data.size:
+        # Nothing to aggregate; some of the reductions would fail on an empty
+        # array. The result has no columns, just like the input
+        return np.empty(data.shape[1:-1] + (0,))
+
+    result = vectorized_functions[func](data, axis=0)
+    if isinstance(result, tuple):
+        parts, num_parts = result, len(result)
+        result = np.empty(parts[0].shape[:-1] + (parts[0].shape[-1] * num_parts,))
+        for idx, part in enumerate(parts):
+            result[..., idx::num_parts] = part
+    return result
+
+
+def reduce_items(columns, func):
+    """Applies the given aggregation function to each of the given sequences
+    of values one by one. This is used instead of `reduce_table()` when the
+    rows of the input have different lengths.
+
+    Returns a flat list of results; functions with multiple return values
+    have their results interleaved."""
+    result = []
+    for items in columns:
+        value = func(items)
+        if isinstance(value, tuple):
+            result.extend(value)
+        else:
+            result.append(value)
+    return result
+
+
+def process_files_column(infiles, options):
+    """Processes the given files in ``column`` mode.
+    
+    Files will be processed sequentially. The output is a single line for
+    each file where column i contains the result of the aggregation function
+    for the column of the file.
+    """
+    for idx, filename in enumerate(infiles):
+        process_files_column_single(open_anything(filename), options, idx == 0)
+
+
+def process_files_column_single(fp, options, first_file=False):
+    """Processes the given stream (open file) in ``column`` mode."""
+    # Some caching to avoid costly lookups
+    func = options.function
+    join = options.out_delimiter.join
+
+    raw_headers = can_pass_headers_through(options)
+    headers, data = load_table(fp, options, options.strip, raw_headers)
+
+    # Print the headers if we are in the first file, assuming that the
+    # remaining files contain the same header
+    if first_file:
+        for header in headers:
+            print(header if raw_headers else join(expand_headers(header, func)))
+
+    if isinstance(data, list):
+        # The rows have different lengths so we collect the values of each
+        # column separately. Columns that appear only in a later row start
+        # with a single zero, as in earlier versions of this script
+        columns = []
+        for row in data:
+            if len(columns) < len(row):
+                padding = [0.0] if columns else []
+                columns.extend(list(padding) for _ in range(len(row) - len(columns)))
+            for value, column in zip(row, columns):
+                column.append(value)
+        result = reduce_items(columns, func)
+    else:
+        result = reduce_table(data, func)
 
     # Print the output
-    print(join(list(map(str, flatten(func(items) for items in result)))))
+    print(join(list(map(str, result))))
 
 
 def process_files_multiple(infiles, options):
@@ -212,63 +376,47 @@ def process_files_multiple(infiles, options):
     
     Files will be processed in parallel; row i of each file will be aggregated
     using the aggregation function into row i of the output."""
-    # Calculate the column indices we are interested in
-    if options.fields:
-        col_idxs = [f - 1 for f in options.fields]
-    else:
-        col_idxs = None
-
     # Some caching to avoid costly lookups
-    delim = options.in_delimiter
-    fields = options.fields
     func = options.function
     join = options.out_delimiter.join
 
-    # Flag to denote whether we have seen at least one row with numbers.
-    # If not, we are still processing the headers.
-    data_started = False
-
-    for lines in zip(*[open_anything(f) for f in infiles]):
-        # Split the input line
-        lines = [line.strip().split(delim) for line in lines]
-
-        # Select the relevant columns only
-        if col_idxs:
-            lines = [sublist(line, col_idxs) for line in lines]
-
-        if not data_started:
-            # Check whether this row contains numbers only (at least in the
-            # columns we are interested in)
-            if any(not only_numbers(line) for line in lines):
-                # This is a header, print it from the first file, assuming
-                # that the remaining files contain the same header
-                if hasattr(func, "argout"):
-                    headers = []
-                    for header in lines[0]:
-                        headers.extend(
-                            "%s_%s" % (header, arg) if arg else header
-                            for arg in func.argout
-                        )
-                    print(join(headers))
-                else:
-                    print(join(lines[0]))
-                continue
-            else:
-                # Yay, finally real data!
-                data_started = True
-
-        # Convert the columns of interest to floats
-        lines = [[float(x) for x in line] for line in lines]
-
-        # Print the output
-        row = []
-        for items in zip(*lines):
-            result = func(items)
-            if hasattr(result, "__iter__"):
-                row.extend(str(item) for item in result)
-            else:
-                row.append(str(result))
-        print(join(row))
+    # Load all the files. The files are loaded in separate threads so the
+    # reads from different files can overlap
+    raw_headers = can_pass_headers_through(options)
+
+    def load_file(filename):
+        return load_table(open_anything(filename), options, True, raw_headers)
+
+    num_workers = min(len(infiles), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        results = list(executor.map(load_file, infiles))
+    headers = results[0][0]
+    tables = [data for _, data in results]
+
+    # Print the headers from the first file, assuming that the remaining
+    # files contain the same header
+    for header in headers:
+        print(header if raw_headers else join(expand_headers(header, func)))
+
+    if any(isinstance(data, list) for data in tables):
+        # Some of the files have rows of different lengths, so we aggregate
+        # them row by row, using the columns that are present in all the files
+        for rows in zip(*tables):
+            print(join(map(str, reduce_items(zip(*rows), func))))
+        return
+
+    # Stack the tables into a single array of shape (files, rows, columns),
+    # dropping rows and columns that are not present in all the files. The
+    # aggregation then becomes a reduction along the first axis
+    num_rows = min(len(data) for data in tables)
+    num_cols = min(data.shape[1] for data in tables)
+    data = np.stack([data[:num_rows, :num_cols] for data in tables])
+
+    # Aggregate all the rows at once and print the output. np.savetxt()
+    # formats and writes the rows without a print() call for each of them
+    np.savetxt(
+        sys.stdout, reduce_table(data, func), delimiter=options.out_delimiter, fmt="%s"
+    )
 
 
 @main_func
@@ -277,6 +425,8 @@ def main():
     parser = create_option_parser()
     options, args = parser.parse_args()
 
+    options.function = functions[options.function]
+
     if options.fields:
         options.fields = list(options.fields)
 
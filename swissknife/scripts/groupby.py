@@ -11,7 +11,7 @@ from swissknife.utils import (
     main_func,
     open_anything,
     parse_index_specification,
-    sublist,
+    sublist_getter,
 )
 
 from collections import defaultdict
@@ -65,6 +65,15 @@ def create_option_parser():
         default=False,
         help="keep unique entries only",
     )
+    parser.add_option(
+        "--sorted",
+        action="store_true",
+        dest="sorted",
+        default=False,
+        help="assume that rows with the same key are next to each other "
+        "in the input. Each group is printed as soon as it ends, so only "
+        "the current group is kept in memory.",
+    )
     parser.add_option(
         "--strip",
         action="store_true",
@@ -81,44 +90,63 @@ def process_file(infile, options):
     # Calculate the column indices we are interested in
     if options.fields:
         col_idxs = [f - 1 for f in options.fields]
+        select_columns = sublist_getter(col_idxs)
     else:
         col_idxs = None
 
-    # Dictionary to map keys to values
+    # Dictionary to map keys to values, and the function that adds new
+    # values to the collection of an existing key
     if options.unique:
         keys_to_values = defaultdict(set)
+        add_values = set.update
     else:
         keys_to_values = defaultdict(list)
+        add_values = list.extend
 
-    # Some caching to avoid costly lookups
-    delim = options.in_delimiter
+    # Some caching to avoid costly lookups. The input is processed as bytes
+    # so we don't need to decode (and then encode) the whole file
+    delim = options.in_delimiter.encode("utf-8")
     fields = options.fields
-    join = options.out_delimiter.join
-
-    # Set up characters to strip from lines
-    chars_to_strip = " \t\r\n" if options.strip else "\r\n"
+    join = options.out_delimiter.encode("utf-8").join
+    write = sys.stdout.buffer.write
+    sorted_input = options.sorted
+
+    def print_groups():
+        """Prints the key-value pairs collected so far and forgets them."""
+        for key, values in keys_to_values.items():
+            write(join(chain([key], values)) + b"\n")
+        keys_to_values.clear()
+
+    # Set up the function and the characters to strip from lines. Line
+    # terminators need to be removed from the end of the line only
+    if options.strip:
+        strip, chars_to_strip = bytes.strip, b" \t\r\n"
+    else:
+        strip, chars_to_strip = bytes.rstrip, b"\r\n"
 
-    for line in open_anything(infile):
+    for line in open_anything(infile, "rb"):
         # Split the input line
-        parts = line.strip(chars_to_strip).split(delim)
+        parts = strip(line, chars_to_strip).split(delim)
 
         # Select the relevant columns only
         if col_idxs:
-            parts = sublist(parts, col_idxs)
+            parts = select_columns(parts)
 
         # If the row is empty, continue
         if not parts:
             continue
 
+        # If the input is sorted, a new key means that the previous group
+        # is complete so we can print it right now
+        key = parts[0]
+        if sorted_input and key not in keys_to_values:
+            print_groups()
+
         # Store the row to its appropriate key
-        if options.unique:
-            keys_to_values[parts[0]].update(parts[1:])
-        else:
-            keys_to_values[parts[0]].extend(parts[1:])
-
-    # Print the key-value pairs
-    for key, values in keys_to_values.items():
-        print(join(chain([key], values)))
+        add_values(keys_to_values[key], parts[1:])
+
+    # Print the remaining key-value pairs
+    print_groups()
 
 
 @main_func
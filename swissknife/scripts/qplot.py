@@ -10,7 +10,6 @@ from swissknife.error import AppError
 from swissknife.utils import (
     lenient_float,
     main_func,
-    mask_nans,
     open_anything,
     parse_date,
     parse_index_specification,
@@ -19,11 +18,28 @@ from swissknife.utils import (
     TableWithHeaderIterator,
 )
 
-from itertools import cycle, islice, zip_longest
+from functools import lru_cache
+from itertools import cycle, islice, product, zip_longest
 from math import ceil
-from numpy import arange, array, isnan, meshgrid, linspace, sqrt, zeros, NaN
+from numpy import (
+    arange,
+    array,
+    asarray,
+    cumsum,
+    float32,
+    frombuffer,
+    fromiter,
+    full,
+    hypot,
+    isnan,
+    meshgrid,
+    nan_to_num,
+    linspace,
+    unique,
+    zeros,
+    NaN,
+)
 from numpy.ma import masked_where
-from warnings import warn
 
 import optparse
 import re
@@ -34,6 +50,22 @@ DEFAULT_COLORS = "bgrcmyk"
 DEFAULT_LINE_STYLES = "- -- -. :".split()
 DEFAULT_MARKERS = "os^v<>+*dph8"
 
+HEADER_STYLE_REGEX = re.compile(r"(.*)\[\[([^\]]+)\]\]")
+
+# Scatter plot series with more points than this are rasterized even in
+# vector graphics output
+SCATTER_RASTERIZATION_THRESHOLD = 10000
+
+# Regex that strips the X prefix or suffix from the header of the X column
+# of an X-Y pair in scatter plots to get the legend label
+SCATTER_LABEL_REGEX = re.compile(r"(?:x_|x )?(.*?)(?:_x| x|\(x\))?", re.DOTALL)
+
+# Regex matching dates that NumPy can convert to datetime64 on its own
+ISO_DATE_REGEX = re.compile(r"\d{4}-\d{2}-\d{2}$")
+
+# Ordinal number of 1970-01-01, the epoch of NumPy's datetime64 type
+EPOCH_ORDINAL = 719163
+
 
 def create_option_parser():
     """Creates an `OptionParser` that parses the command line
@@ -159,16 +191,7 @@ def create_option_parser():
         "--type",
         metavar="TYPE",
         dest="type",
-        choices=(
-            "bar",
-            "heatmap",
-            "line",
-            "quiver",
-            "scatter",
-            "scatter3d",
-            "surface",
-            "wireframe",
-        ),
+        choices=sorted(PLOT_FUNCTIONS.keys()),
         default="line",
         help="the type of plot to draw (bar, heatmap, line, quiver, "
         "scatter, scatter3d, surface or wireframe)",
@@ -196,6 +219,16 @@ def create_option_parser():
         action="store_false",
         help="hide the legend from the plot.",
     )
+    output_group.add_option(
+        "--max-points",
+        dest="max_points",
+        default=200000,
+        metavar="N",
+        type=int,
+        help="plot at most N points from each series of a scatter plot by "
+        "keeping only every kth point of larger series. Zero means no limit. "
+        "Default is 200000.",
+    )
     output_group.add_option(
         "--no-title",
         dest="no_title",
@@ -419,50 +452,101 @@ def create_option_parser():
     return parser
 
 
+@lru_cache(maxsize=None)
+def get_triangulation_classes():
+    """Returns the ``Triangulation`` and ``LinearTriInterpolator`` classes of
+    Matplotlib. The classes are imported on the first call only; later calls
+    return them from a cache."""
+    from matplotlib.tri import LinearTriInterpolator, Triangulation
+
+    return Triangulation, LinearTriInterpolator
+
+
+@lru_cache(maxsize=None)
+def get_contour_options():
+    """Returns the extra keyword arguments to pass to ``contour()``.
+
+    Matplotlib 3.6 and later can use the ``serial`` algorithm of contourpy,
+    which is considerably faster than the default ``mpl2014`` algorithm on
+    large grids. Earlier versions do not know the ``algorithm`` argument."""
+    from matplotlib import rcParams
+
+    return dict(algorithm="serial") if "contour.algorithm" in rcParams else {}
+
+
+@lru_cache(maxsize=None)
+def get_formatter_classes():
+    """Returns the ``FuncFormatter`` and ``ScalarFormatter`` classes of
+    Matplotlib. The classes are imported on the first call only; later calls
+    return them from a cache."""
+    from matplotlib.ticker import FuncFormatter, ScalarFormatter
+
+    return FuncFormatter, ScalarFormatter
+
+
+@lru_cache(maxsize=8)
+def get_triangulation(xs_bytes, ys_bytes):
+    """Returns a Matplotlib triangulation of the points whose X and Y
+    coordinates are given as the raw bytes of two float arrays.
+
+    Triangulations are cached by their coordinates so plots that share the
+    same X-Y points (e.g., several Z columns measured on the same grid) are
+    triangulated only once. The point locator that Matplotlib builds for a
+    triangulation is cached along with it."""
+    Triangulation, _ = get_triangulation_classes()
+    return Triangulation(frombuffer(xs_bytes), frombuffer(ys_bytes))
+
+
 def interpolate_to_regular_grid(xs, ys, zs, options):
     """Interpolates irregularly spaced three-dimensional data to a regular
-    grid. The grid size is determined by `options.grid_size`."""
-    from matplotlib.mlab import griddata
-
-    grid_size = options.grid_size
-    min_x, max_x = min(xs), max(xs)
-    min_y, max_y = min(ys), max(ys)
-    tries = 3
-    zi = None
-
-    while True:
-        xi = linspace(min_x, max_x, num=int(grid_size[0]))
-        yi = linspace(min_y, max_y, num=int(grid_size[1]))
-        try:
-            zi = griddata(xs, ys, array(zs), xi, yi, interp="linear")
-            break
-        except ValueError as err:
-            if err.message and err.message.startswith(
-                "output grid must have constant spacing"
-            ):
-                # We do have constant spacing but it is inaccurate. Try
-                # doubling the grid size
-                grid_size = grid_size[0] * 2, grid_size[1] * 2
-                tries -= 1
-                if tries <= 0:
-                    # Give up
-                    break
-
-    if zi is None:
-        # Okay, we gave up, let's just use nearest neighbor
-        # interpolation with the original grid size
-        xi = linspace(min_x, max_x, num=int(options.grid_size[0]))
-        yi = linspace(min_y, max_y, num=int(options.grid_size[1]))
-        zi = griddata(xs, ys, array(zs), xi, yi, interp="nn")
-        warn(
-            "Using nearest neighbor interpolation instead of "
-            "linear; watch out for artifacts if the X and "
-            "Y ranges are wildly different"
-        )
+    grid. The grid size is determined by `options.grid_size`.
+
+    The data points are triangulated once and the triangulation is then used
+    to interpolate linearly on the whole grid at once. Grid points outside
+    the convex hull of the data points are masked. The interpolated values
+    are returned in single precision, which is more than enough for
+    colormaps and contours and halves the size of large grids."""
+    _, LinearTriInterpolator = get_triangulation_classes()
+
+    xs, ys = asarray(xs, dtype=float), asarray(ys, dtype=float)
+    zs = asarray(zs)
+
+    xi = linspace(xs.min(), xs.max(), num=int(options.grid_size[0]))
+    yi = linspace(ys.min(), ys.max(), num=int(options.grid_size[1]))
+    triangulation = get_triangulation(xs.tobytes(), ys.tobytes())
+    interpolator = LinearTriInterpolator(triangulation, zs)
+    zi = interpolator(*meshgrid(xi, yi)).astype(float32)
 
     return xi, yi, zi
 
 
+def parse_dates_to_ordinals(dates, format):
+    """Parses the given list of date strings using the given `format` and
+    returns a NumPy array containing the number of days that have passed
+    since 0001-01-01 UTC for each date. Dates that cannot be parsed are
+    mapped to NaN.
+
+    When the format is ``%Y-%m-%d`` and all the dates are written in this
+    format with zero-padded fields, the dates are converted by NumPy in a
+    single call. Otherwise the dates are parsed one by one."""
+    if format == "%Y-%m-%d" and all(
+        isinstance(date, str) and ISO_DATE_REGEX.match(date) for date in dates
+    ):
+        try:
+            days_since_epoch = array(dates, dtype="datetime64[D]").astype(float)
+        except ValueError:
+            # Invalid date such as 2021-02-30; let parse_date() handle it
+            pass
+        else:
+            return days_since_epoch + EPOCH_ORDINAL
+
+    return fromiter(
+        (parse_date(date, format=format, default=NaN, ordinal=True) for date in dates),
+        dtype=float,
+        count=len(dates),
+    )
+
+
 def plot_file_on_figure(infile, figure, options):
     """Plots the dataset in the given file on the given figure."""
     iterator = TableWithHeaderIterator(
@@ -473,7 +557,7 @@ def plot_file_on_figure(infile, figure, options):
         strip=options.strip,
     )
     iterator.first_column_is_date = "x" in options.dates
-    func = globals()["plot_%s_from_table_iterator" % options.type]
+    func = PLOT_FUNCTIONS[options.type]
     func(iterator, figure, options)
 
     # Add the title
@@ -514,7 +598,7 @@ def add_axis_titles(primary_axes, secondary_axes, options):
 
 def get_axis_formatter_for_format(format):
     """Returns an axis formatter suitable for the given ``format``."""
-    from matplotlib.ticker import FuncFormatter, ScalarFormatter
+    FuncFormatter, ScalarFormatter = get_formatter_classes()
 
     if format == "numeric":
         return ScalarFormatter()
@@ -581,36 +665,28 @@ def setup_legend(all_axes, legend_handles, legend_labels, options):
         return
 
     legend_axis = all_axes[-1]
+    legend_obj = legend_axis.legend(legend_handles, legend_labels, loc=options.legend)
+    legend_obj.get_frame().set_alpha(0.75)
 
-    if options.twin and options.legend == "best":
+    if len(all_axes) > 1 and options.legend == "best":
         # We have two Y axes. The problem is that the "best placement"
         # algorithm in Matplotlib takes into account only the contents
-        # of the axis on which the legend is placed. We fix that here.
-        # This is terrible monkey-patching but we cannot do any better.
-        from matplotlib.legend import Legend
+        # of the axis on which the legend is placed. We fix that by letting
+        # this legend instance (and only this one) consider the contents of
+        # the primary axis as well. The contents are collected from a
+        # detached legend of the primary axis when the legend is drawn.
+        primary_axes = all_axes[0]
+        primary_legend = primary_axes.legend(legend_handles, legend_labels)
+        primary_axes.legend_ = None
+        get_own_legend_data = legend_obj._auto_legend_data
 
-        tmp_legend = all_axes[0].legend(legend_handles, legend_labels)
-        tmp_data = tmp_legend._auto_legend_data()
-        all_axes[0].legend_ = None
-        del tmp_legend
+        def auto_legend_data_of_all_axes():
+            result = get_own_legend_data()
+            for items, primary_items in zip(result, primary_legend._auto_legend_data()):
+                items.extend(primary_items)
+            return result
 
-        old_func = Legend._auto_legend_data
-
-        def patched_auto_legend_data(self):
-            super_data = old_func(self)
-            for idx, item in enumerate(super_data):
-                item += tmp_data[idx]
-            return super_data
-
-        Legend._auto_legend_data = patched_auto_legend_data
-    else:
-        old_func = None
-
-    legend_obj = legend_axis.legend(legend_handles, legend_labels, loc=options.legend)
-    legend_obj.get_frame().set_alpha(0.75)
-
-    # if old_func is not None:
-    #     Legend._auto_legend_data = old_func
+        legend_obj._auto_legend_data = auto_legend_data_of_all_axes
 
 
 def parse_headers(headers):
@@ -627,9 +703,9 @@ def parse_headers(headers):
         return None, []
 
     new_headers, specs = [], []
-    rex = re.compile(r"(.*)\[\[([^\]]+)]]$")
     for header in headers:
-        match = rex.match(header)
+        # Cheap test first; most headers have no style specification at all
+        match = header.endswith("]]") and HEADER_STYLE_REGEX.fullmatch(header)
         if match:
             new_headers.append(match.group(1).strip())
             specs.append(match.group(2))
@@ -643,37 +719,21 @@ def plot_bar_from_table_iterator(table_iterator, figure, options):
     """Plots the dataset whose rows will be yielded by the given
     `table_iterator` (an instance of `TableWithHeaderIterator`)
     using bar plots. The plot will be drawn on `figure`."""
-    yss = []
-    for values in table_iterator:
-        # Less than one value? If so, skip this line.
-        if len(values) < 1:
-            continue
-
-        # Not enough columns? Add the missing ones.
-        if len(values) < len(yss):
-            values.extend([None] * (len(yss) - len(values)))
-
-        # For the time being, we put everything in yss and
-        # will separate them later into Y coordinates and
-        # error bars if options.errorbars is not none
-        if not yss:
-            # First row, must extend yss with columns
-            yss = [[y] for y in values]
-        else:
-            for ys, y in zip(yss, values):
-                ys.append(y)
+    # Read the whole table; empty rows are skipped. For the time being, we
+    # put everything in yss and will separate them later into Y coordinates
+    # and error bars if options.errorbars is not none
+    data, _ = table_iterator.as_array(1)
 
     headers, style_overrides = parse_headers(table_iterator.headers)
 
     # Calculate the legend labels
     legend_handles, legend_labels = [], []
-    if yss and headers is not None:
+    if len(data) and headers is not None:
         legend_labels = headers[:]
 
-    # Mask NaNs in yss
-    yss = [[y if y is not None else NaN for y in ys] for ys in yss]
-    yss = array(yss)
-    yss = masked_where(isnan(yss), yss)
+    # Missing values are plotted as zero-height bars. nan_to_num() returns a
+    # plain array, which is much cheaper to work with than a masked one
+    yss = nan_to_num(data.T, nan=0.0)
 
     # Handle error bars
     if options.errorbars == "y":
@@ -686,35 +746,35 @@ def plot_bar_from_table_iterator(table_iterator, figure, options):
         # No error bars
         errorbars = None
 
-    # Set up the colors to be used
-    colors = DEFAULT_COLORS
-    styles = list(colors)
+    # Set up the list of axes we will use
+    primary_axes = figure.gca()
+    all_axes = [primary_axes, primary_axes.twinx()] if options.twin else [primary_axes]
 
-    # Override the line styles where the header says so
-    for idx, override in enumerate(style_overrides[1:]):
+    # Assign the axes and the colors to the series in advance
+    num_axes, num_colors = len(all_axes), len(DEFAULT_COLORS)
+    series_axes = [all_axes[i % num_axes] for i in range(len(yss))]
+    series_styles = [DEFAULT_COLORS[i % num_colors] for i in range(len(yss))]
+
+    # Override the colors where the header says so
+    for idx, override in enumerate(style_overrides[1 : len(yss) + 1]):
         if override is not None:
-            styles[idx] = override
+            series_styles[idx] = override
 
-    # Set up the list of axes we will use
-    all_axes = [figure.gca()]
-    if options.twin:
-        all_axes.append(figure.gca().twinx())
+    # Calculate the bottoms of the stacked bars for all the series in a
+    # single pass; the bottom of series i is the sum of series 0..i-1
+    all_bottoms = zeros(yss.shape)
+    cumsum(yss[:-1], axis=0, out=all_bottoms[1:])
 
     # Plot the bars
     xs = arange(0, len(yss[0]))
-    bottoms = zeros(len(yss[0]))
-    i = 0
-    for axes, style, ys in zip(cycle(all_axes), cycle(styles), yss):
-        params = dict(left=xs, height=ys, bottom=bottoms, color=style)
+    for i, ys in enumerate(yss):
+        params = dict(x=xs, height=ys, bottom=all_bottoms[i], color=series_styles[i])
         if errorbars is not None:
             params["yerr"] = errorbars[i]
-            i += 1
 
-        handle = axes.bar(**params)
+        handle = series_axes[i].bar(**params)
         legend_handles.append(handle[0])
 
-        bottoms += ys
-
     # Set up the axes
     setup_axes(all_axes, options)
 
@@ -726,18 +786,14 @@ def plot_heatmap_from_table_iterator(table_iterator, figure, options):
     """Plots a heatmap whose X-Y coordinates and Z values come from the given
     `table_iterator`. The plot will be drawn on `figure`."""
 
-    xs, ys, zs = [], [], []
-    for values in table_iterator:
-        # Less than three values? If so, skip this line.
-        if len(values) < 3:
-            continue
-        # Any of the values missing? If so, skip this line
-        if any(value is None for value in values):
-            continue
-        # Store the values
-        xs.append(values[0])
-        ys.append(values[1])
-        zs.append(values[2])
+    # Read the whole table; rows with less than three values are skipped.
+    # Only the first three columns are used
+    data, _ = table_iterator.as_array(3)
+    data = data[:, :3]
+
+    # Any of the values missing? If so, skip the row
+    data = data[~isnan(data).any(axis=1)]
+    xs, ys, zs = data[:, 0], data[:, 1], data[:, 2]
 
     # Create a regular grid
     xi, yi, zi = interpolate_to_regular_grid(xs, ys, zs, options)
@@ -757,7 +813,7 @@ def plot_heatmap_from_table_iterator(table_iterator, figure, options):
 
     # Show the contour plot if needed
     if options.contours:
-        contours = axes.contour(xi, yi, zi, colors="k")
+        contours = axes.contour(xi, yi, zi, colors="k", **get_contour_options())
         if options.contour_labels:
             axes.clabel(contours, inline=1)
 
@@ -776,50 +832,27 @@ def plot_line_from_table_iterator(table_iterator, figure, options):
     """Plots the dataset whose rows will be yielded by the given
     `table_iterator` (an instance of `TableWithHeaderIterator`).
     The plot will be drawn on `figure`."""
-    xs, yss = [], []
-    for values in table_iterator:
-        # Less than two values? If so, skip this line.
-        if len(values) < 2:
-            continue
-
-        # Not enough columns? Add the missing ones.
-        if len(values) < len(yss) + 1:
-            values.extend([None] * (len(yss) + 1 - len(values)))
-
-        # The first value is the X coordinate. We put the
-        # rest in yss and will separate them later into Y
-        # coordinates and error bars if options.errorbars
-        # is not none
-        xs.append(values[0])
-        if not yss:
-            # First row, must extend yss with columns
-            yss = [[y] for y in islice(values, 1, None)]
-        else:
-            for ys, y in zip(yss, islice(values, 1, None)):
-                ys.append(y)
+    # Read the whole table; rows with less than two values are skipped.
+    # The first column contains the X coordinates. We put the rest in yss
+    # and will separate them later into Y coordinates and error bars if
+    # options.errorbars is not none
+    data, dates = table_iterator.as_array(2)
 
     headers, style_overrides = parse_headers(table_iterator.headers)
 
     # Calculate the legend labels
     legend_handles, legend_labels = [], []
-    if yss and headers is not None:
+    if len(data) and headers is not None:
         legend_labels = headers[1:]
 
+    # Missing values stay NaNs; Matplotlib leaves gaps in the lines for them
+    # just like it would for masked values
+    xs, yss = data[:, :1].ravel(), data[:, 1:].T
+
     # If the x axis contains dates, map them to dates since 0001-01-01 UTC
     # since Matplotlib requires this
-    if options.dates == "x" or options.dates == "xy":
-        xs = [
-            parse_date(x, format=options.date_format, default=NaN, ordinal=True)
-            for x in xs
-        ]
-
-    # Mask NaNs in xs
-    xs = mask_nans(xs)
-
-    # Mask NaNs in yss
-    yss = [[y if y is not None else NaN for y in ys] for ys in yss]
-    yss = array(yss)
-    yss = masked_where(isnan(yss), yss)
+    if dates is not None:
+        xs = parse_dates_to_ordinals(dates, options.date_format)
 
     # Handle error bars
     if options.errorbars == "y":
@@ -832,22 +865,27 @@ def plot_line_from_table_iterator(table_iterator, figure, options):
         # No error bars
         errorbars = None
 
-    # Set up the line styles to be used
-    colors = DEFAULT_COLORS
-    styles = DEFAULT_LINE_STYLES
-    line_styles = [color + style for style in styles for color in colors]
-    bar_styles = [color + "o" for style in styles for color in colors]
+    # Set up the line styles to be used. Only as many styles are generated
+    # as there are series; the styles of the error bars are needed only if
+    # we have error bars
+    num_series = len(yss)
+    combinations = list(
+        islice(cycle(product(DEFAULT_LINE_STYLES, DEFAULT_COLORS)), num_series)
+    )
+    series_styles = [color + style for style, color in combinations]
+    if errorbars is not None:
+        bar_styles = [color + "o" for _, color in combinations]
 
     # Override the line styles where the header says so
-    for idx, override in enumerate(style_overrides[1:]):
+    for idx, override in enumerate(style_overrides[1 : num_series + 1]):
         if override is not None:
-            line_styles[idx] = override
-            bar_styles[idx] = override
+            series_styles[idx] = override
+            if errorbars is not None:
+                bar_styles[idx] = override
 
     # Set up the list of axes we will use
-    all_axes = [figure.gca()]
-    if options.twin:
-        all_axes.append(figure.gca().twinx())
+    primary_axes = figure.gca()
+    all_axes = [primary_axes, primary_axes.twinx()] if options.twin else [primary_axes]
 
     # Calculate the desired sizes factor from the figure width
     size_scale_factor = options.scale
@@ -856,8 +894,12 @@ def plot_line_from_table_iterator(table_iterator, figure, options):
     line_width = size_scale_factor
     kwargs = dict(markersize=marker_size, linewidth=line_width)
 
+    # Assign the axes to the series in advance
+    num_axes = len(all_axes)
+    series_axes = [all_axes[i % num_axes] for i in range(len(yss))]
+
     # Plot the lines
-    for axes, style, ys in zip(cycle(all_axes), cycle(line_styles), yss):
+    for axes, style, ys in zip(series_axes, series_styles, yss):
         if options.dates != "none":
             handle = axes.plot_date(xs, ys, style, **kwargs)
         else:
@@ -872,9 +914,7 @@ def plot_line_from_table_iterator(table_iterator, figure, options):
         marker_freq = int(ceil(total_marker_width_inches * 2 / figure.get_figwidth()))
 
         # Now plot the error bars
-        for axes, style, ys, yerrs in zip(
-            cycle(all_axes), cycle(bar_styles), yss, errorbars
-        ):
+        for axes, style, ys, yerrs in zip(series_axes, bar_styles, yss, errorbars):
             # Subsample xs and ys if needed -- markevery would subsample the
             # markers only but not the error bars
             if marker_freq > 1:
@@ -897,36 +937,29 @@ def plot_quiver_from_table_iterator(table_iterator, figure, options):
     """Plots a 2D quiver plot (a.k.a. vector field) whose points come from the
     given `table_iterator`. The plot will be drawn on `figure`."""
 
-    xs, ys, us, vs = [], [], [], []
-    for values in table_iterator:
-        # Less than two values? If so, skip this line.
-        if len(values) < 2:
-            continue
-        # Pad the values with zeros up to length 4
-        if len(values) < 4:
-            values += [0.0] * (4 - len(values))
-        # Any of the values missing? If so, skip this line
-        if any(value is None for value in values):
-            continue
-        # Store the values
-        xs.append(values[0])
-        ys.append(values[1])
-        us.append(values[2])
-        vs.append(values[3])
-
-    # Mask NaNs in us and vs. Matplotlib does not support masks in
-    # xs or ys
-    us = mask_nans(us)
-    vs = mask_nans(vs)
-    grads = sqrt(us * us + vs * vs)
+    # Read the whole table; rows with less than two values are skipped. The
+    # table is at least four columns wide even if the first row is shorter
+    data, _ = table_iterator.as_array(2, min_width=4)
+
+    # Missing U and V values are zeros; this includes the U and V values of
+    # rows with less than four values
+    uvs = data[:, 2:4]
+    uvs[isnan(uvs)] = 0.0
+
+    # Any of the coordinates missing? If so, skip the row
+    data = data[~isnan(data[:, :2]).any(axis=1)]
+    xs, ys, us, vs = data[:, 0], data[:, 1], data[:, 2], data[:, 3]
 
     # Get the axes
     axes = figure.gca()
 
     # Plot the gradient contours
     if options.contours:
+        # Calculate the lengths of the vectors in a single pass, in single
+        # precision as they are used for the contours only
+        grads = hypot(us, vs, dtype=float32)
         xi, yi, gi = interpolate_to_regular_grid(xs, ys, grads, options)
-        contours = axes.contour(xi, yi, gi)
+        contours = axes.contour(xi, yi, gi, **get_contour_options())
         if options.contour_labels:
             axes.clabel(contours, inline=1)
 
@@ -943,36 +976,17 @@ def plot_scatter_from_table_iterator(table_iterator, figure, options):
     """Plots a 2D scatterplot whose points come from the given `table_iterator`.
     The plot will be drawn on `figure`."""
 
+    # Read the whole table; rows with an odd number of values are skipped.
+    # Values come in X-Y pairs
+    data, _ = table_iterator.as_array(2, pairs=True)
+
+    # When X is missing, we skip the corresponding Y value. Similarly, when
+    # Y is missing, we skip the corresponding X value
     xss, yss = [], []
-    for values in table_iterator:
-        # Odd number of columns? If so, skip this line.
-        if len(values) % 2 != 0:
-            continue
-
-        # Not enough columns? Add the missing ones
-        if len(values) < len(xss) * 2:
-            values.extend([None] * (len(xss) * 2 - len(values)))
-
-        # Values come in X-Y pairs. When X is None, we skip the
-        # corresponding Y value. Similarly, when Y is None, we skip
-        # the corresponding X value. First, we iterate over values
-        # and make sure that Y is None iff X is None
-        for index in range(len(values)):
-            if values[index] is None:
-                values[index ^ 1] = None
-
-        # Now we can store the X-Y pairs, skipping None values
-        if not xss:
-            # First row, must extend xss and yss with columns
-            xss = [[x] if x is not None else [] for x in islice(values, 0, None, 2)]
-            yss = [[y] if y is not None else [] for y in islice(values, 1, None, 2)]
-        else:
-            for xs, x in zip(xss, islice(values, 0, None, 2)):
-                if x is not None:
-                    xs.append(x)
-            for ys, y in zip(yss, islice(values, 1, None, 2)):
-                if y is not None:
-                    ys.append(y)
+    for xs, ys in zip(data[:, 0::2].T, data[:, 1::2].T):
+        present = ~(isnan(xs) | isnan(ys))
+        xss.append(xs[present])
+        yss.append(ys[present])
 
     headers, style_overrides = parse_headers(table_iterator.headers)
 
@@ -982,20 +996,9 @@ def plot_scatter_from_table_iterator(table_iterator, figure, options):
         legend_labels = headers[::2]
 
     # Strip suffixes and prefixes from the end of the legend labels
-    new_labels = []
-    suffixes = ["_x", " x", "(x)"]
-    prefixes = ["x_", "x "]
-    for label in legend_labels:
-        for prefix in prefixes:
-            if label.startswith(prefix):
-                label = label[len(prefix) :]
-                break
-        for suffix in suffixes:
-            if label.endswith(suffix):
-                label = label[: -len(suffix)]
-                break
-        new_labels.append(label.strip())
-    legend_labels = new_labels
+    legend_labels = [
+        SCATTER_LABEL_REGEX.fullmatch(label).group(1).strip() for label in legend_labels
+    ]
 
     # Set up the marker styles to be used
     colors = DEFAULT_COLORS
@@ -1010,9 +1013,16 @@ def plot_scatter_from_table_iterator(table_iterator, figure, options):
     axes = figure.gca()
     all_axes = [axes]
 
-    # Plot the scatterplot
+    # Plot the scatterplot. Large series are decimated and rasterized as
+    # Matplotlib gets very slow with millions of points, especially when
+    # it has to write them one by one into a vector graphics file
+    max_points = options.max_points
     for xs, ys, style in zip(xss, yss, cycle(styles)):
-        handle = axes.scatter(xs, ys, c=style)
+        if max_points > 0 and len(xs) > max_points:
+            step = -(-len(xs) // max_points)
+            xs, ys = xs[::step], ys[::step]
+        rasterized = len(xs) > SCATTER_RASTERIZATION_THRESHOLD
+        handle = axes.scatter(xs, ys, c=style, rasterized=rasterized)
         legend_handles.append(handle)
 
     # Set up the axes
@@ -1028,18 +1038,14 @@ def plot_scatter3d_from_table_iterator(table_iterator, figure, options):
     """Plots a 3D scatterplot whose points come from the given `table_iterator`.
     The plot will be drawn on `figure`."""
 
-    xs, ys, zs = [], [], []
-    for values in table_iterator:
-        # Less than three values? If so, skip this line.
-        if len(values) < 3:
-            continue
-        # Any of the values missing? If so, skip this line
-        if any(value is None for value in values):
-            continue
-        # Store the values
-        xs.append(values[0])
-        ys.append(values[1])
-        zs.append(values[2])
+    # Read the whole table; rows with less than three values are skipped.
+    # Only the first three columns are used
+    data, _ = table_iterator.as_array(3)
+    data = data[:, :3]
+
+    # Any of the values missing? If so, skip the row
+    data = data[~isnan(data).any(axis=1)]
+    xs, ys, zs = data[:, 0], data[:, 1], data[:, 2]
 
     # Import 3D axes
     from mpl_toolkits.mplot3d import Axes3D
@@ -1060,26 +1066,22 @@ def plot_surface_from_table_iterator(table_iterator, figure, options, wireframe=
     """Plots a 3D surface whose points come from the given `table_iterator`.
     The plot will be drawn on `figure`."""
 
-    xs, ys, zdict = set(), set(), {}
-    for values in table_iterator:
-        # Less than three values? If so, skip this line.
-        if len(values) < 3:
-            continue
-        # Any of the values missing? If so, skip this line
-        if any(value is None for value in values):
-            continue
-        # Store the values
-        xs.add(values[0])
-        ys.add(values[1])
-        zdict[values[0], values[1]] = values[2]
-
-    # Create the mesh grid and fill the Z values
-    xs, ys = sorted(xs), sorted(ys)
-    zs = zeros((len(xs), len(ys)))
-    for i, x in enumerate(xs):
-        for j, y in enumerate(ys):
-            zs[i, j] = zdict.get((x, y), NaN)
-    ys, xs = meshgrid(sorted(ys), sorted(xs))
+    # Read the whole table; rows with less than three values are skipped.
+    # Only the first three columns are used
+    data, _ = table_iterator.as_array(3)
+    data = data[:, :3]
+
+    # Any of the values missing? If so, skip the row
+    data = data[~isnan(data).any(axis=1)]
+
+    # Create the mesh grid and fill the Z values. Each row is mapped to its
+    # cell in the grid by the indices of its X and Y coordinates among the
+    # sorted unique coordinates
+    xs, x_indices = unique(data[:, 0], return_inverse=True)
+    ys, y_indices = unique(data[:, 1], return_inverse=True)
+    zs = full((len(xs), len(ys)), NaN)
+    zs[x_indices, y_indices] = data[:, 2]
+    ys, xs = meshgrid(ys, xs)
     zs = masked_where(isnan(zs), zs)
     # Use the minimum value instead of NaNs -- this is because Matplotlib
     # won't apply the colormap if there are NaNs in the data
@@ -1112,6 +1114,19 @@ def plot_wireframe_from_table_iterator(table_iterator, figure, options):
     )
 
 
+# Plot functions corresponding to the values of the --type option
+PLOT_FUNCTIONS = dict(
+    bar=plot_bar_from_table_iterator,
+    heatmap=plot_heatmap_from_table_iterator,
+    line=plot_line_from_table_iterator,
+    quiver=plot_quiver_from_table_iterator,
+    scatter=plot_scatter_from_table_iterator,
+    scatter3d=plot_scatter3d_from_table_iterator,
+    surface=plot_surface_from_table_iterator,
+    wireframe=plot_wireframe_from_table_iterator,
+)
+
+
 @main_func
 def main():
     """Main entry point of the script."""
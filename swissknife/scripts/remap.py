@@ -9,10 +9,16 @@ Remapping of identifiers in a file using a mapping file or mapping expression.
 from swissknife.error import AppError
 from swissknife.utils import main_func, open_anything, parse_index_specification
 
-import collections
+from collections import deque
+from collections.abc import Set
+import multiprocessing
 import optparse
 import sys
 
+# Number of bytes that the input is split into when it is remapped by worker
+# processes; each chunk is extended to the end of the line it stops in
+CHUNK_SIZE = 1 << 20
+
 
 class SkipRowException(Exception):
     """Exception thrown when we should skip a row from the input
@@ -33,7 +39,7 @@ class cautiousdict(dict):
     found and shows a warning."""
 
     def __missing__(self, key):
-        print("%r not found in mapping" % key, file=sys.stderr)
+        print("%r not found in mapping" % decode_id(key), file=sys.stderr)
         return key
 
 
@@ -61,7 +67,7 @@ class skippingdict(dict):
         raise self.exc
 
 
-class universalset(collections.Set):
+class universalset(Set):
     """Set-like object that contains every object (even itself)"""
 
     def __init__(self):
@@ -85,7 +91,15 @@ class UnknownIDError(AppError):
         self.key = key
 
     def __str__(self):
-        return "unknown ID in input file: {0.key}".format(self)
+        return "unknown ID in input file: {0}".format(decode_id(self.key))
+
+
+def decode_id(value):
+    """Decodes an ID read from a file in binary mode to a string for the
+    sake of error messages and mapping expressions."""
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return value
 
 
 def create_option_parser():
@@ -134,6 +148,17 @@ def create_option_parser():
         callback=indexspec_callback,
         help="use the given columns from the mapping file " "for the old and new IDs",
     )
+    parser.add_option(
+        "-j",
+        "--jobs",
+        metavar="N",
+        dest="jobs",
+        type="int",
+        default=1,
+        help="remap the input in N worker processes in parallel. The input "
+        "is processed in chunks of about 1 MiB, and the output is written in "
+        "the original order as soon as the chunks are ready. Default: 1",
+    )
     parser.add_option(
         "-m",
         "--mapping-file",
@@ -195,21 +220,51 @@ def load_mapping(fname, options):
     old, new = options.mapping_fields
     old -= 1
     new -= 1
-    for row in open_anything(fname):
-        parts = row.strip().split(options.mapping_delimiter)
-        data[parts[old]] = parts[new]
+
+    # The mapping is loaded as bytes, just like the input file that we
+    # remap, so we don't need to decode (and then encode) every ID.
+    # Target IDs that occur multiple times in the mapping are stored only
+    # once; new_ids maps each target ID to its first occurrence
+    delimiter = options.mapping_delimiter.encode("utf-8")
+    new_ids = {}
+    for row in open_anything(fname, "rb"):
+        parts = row.strip().split(delimiter)
+        new_id = parts[new]
+        data[parts[old]] = new_ids.setdefault(new_id, new_id)
     return data
 
 
 def remap_file(infile, mapper, options):
-    """Remaps the entries in the given file using the given callable mapper."""
-    for line in open_anything(infile):
-        parts = line.strip().split(options.delimiter)
+    """Remaps the entries in the given file using the given callable mapper
+    and prints the remapped rows to the standard output.
+
+    The file is processed in binary mode; the mapper receives and returns
+    the IDs as bytes."""
+    remap_lines(open_anything(infile, "rb"), mapper, options, sys.stdout.buffer.write)
+
+
+def remap_lines(lines, mapper, options, write):
+    """Remaps the entries in the given lines (as bytes) using the given
+    callable mapper and passes the remapped rows to the `write` function."""
+    # Some caching to avoid costly lookups. The input is processed as bytes
+    # so we don't need to decode (and then encode) the whole file
+    delimiter = options.delimiter.encode("utf-8")
+    fields = options.fields
+
+    # remap_flags[i] tells whether column i+1 has to be remapped. It is
+    # extended whenever we see a row that is longer than the ones before
+    remap_flags = []
+
+    for line in lines:
+        parts = line.strip().split(delimiter)
+        if len(parts) > len(remap_flags):
+            remap_flags = [idx in fields for idx in range(1, len(parts) + 1)]
+
         new_parts = []
         skip = False
-        for idx, part in enumerate(parts, 1):
+        for part, remap in zip(parts, remap_flags):
             try:
-                if idx in options.fields:
+                if remap:
                     new_parts.append(mapper(part))
                 else:
                     new_parts.append(part)
@@ -221,7 +276,89 @@ def remap_file(infile, mapper, options):
                 skip = True
                 break
         if not skip:
-            print(options.delimiter.join(new_parts))
+            write(delimiter.join(new_parts) + b"\n")
+
+
+def read_chunks(infiles, chunk_size=CHUNK_SIZE):
+    """Reads the given files in binary mode and yields their contents in
+    chunks of about `chunk_size` bytes. Each chunk ends at the end of a
+    line."""
+    for infile in infiles:
+        fp = open_anything(infile, "rb")
+        while True:
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                break
+            if not chunk.endswith(b"\n"):
+                chunk += fp.readline()
+            yield chunk
+
+
+# Mapper and options of the worker processes of remap_files_in_parallel()
+worker_mapper, worker_options = None, None
+
+
+def init_worker(mapper, options):
+    """Initializes a worker process of `remap_files_in_parallel()`."""
+    global worker_mapper, worker_options
+    worker_mapper, worker_options = mapper, options
+
+
+def remap_chunk_in_worker(chunk):
+    """Remaps the lines in the given chunk of the input in a worker process
+    of `remap_files_in_parallel()` and returns the remapped rows."""
+    lines = chunk.split(b"\n")
+    if not lines[-1]:
+        lines.pop()
+
+    output = []
+    remap_lines(lines, worker_mapper, worker_options, output.append)
+    return b"".join(output)
+
+
+def remap_files_in_parallel(infiles, mapper, options):
+    """Remaps the given files in `options.jobs` worker processes and prints
+    the results in the original order.
+
+    The input is read by the main process in chunks that are handed over to
+    the workers. At most two chunks per worker are in flight at any time,
+    so the memory usage does not depend on the size of the input, and the
+    output of each chunk is written as soon as the chunks before it are
+    done."""
+    write = sys.stdout.buffer.write
+    max_pending = 2 * options.jobs
+    with multiprocessing.Pool(
+        options.jobs, initializer=init_worker, initargs=(mapper, options)
+    ) as pool:
+        pending = deque()
+        for chunk in read_chunks(infiles):
+            pending.append(pool.apply_async(remap_chunk_in_worker, (chunk,)))
+            if len(pending) >= max_pending:
+                write(pending.popleft().get())
+        while pending:
+            write(pending.popleft().get())
+
+
+class ExpressionMapper(object):
+    """Callable that calculates the new ID from the old one using a Python
+    expression, where the variable x refers to the old ID.
+
+    Only the source of the expression is pickled, so the mapper can be sent
+    to worker processes."""
+
+    def __init__(self, expr):
+        self.expr = expr
+        self.code = compile(expr, "<mapping-expr>", "eval")
+
+    def __call__(self, value):
+        result = eval(self.code, {}, dict(x=decode_id(value)))
+        return str(result).encode("utf-8")
+
+    def __getstate__(self):
+        return self.expr
+
+    def __setstate__(self, expr):
+        self.__init__(expr)
 
 
 @main_func
@@ -240,6 +377,9 @@ def main():
     else:
         options.fields = set(options.fields)
 
+    if options.jobs < 1:
+        parser.error("the number of jobs must be positive")
+
     if not args:
         args.extend("-")
 
@@ -248,15 +388,19 @@ def main():
             parser.error("-F must specify exactly two columns")
         mapper = load_mapping(options.mapping_file, options).__getitem__
     elif options.mapping_expr:
-
-        def mapper(value):
-            return str(eval(options.mapping_expr, {}, dict(x=value)))
-
+        # The expression is compiled only once instead of once for every ID
+        try:
+            mapper = ExpressionMapper(options.mapping_expr)
+        except SyntaxError as ex:
+            parser.error("invalid mapping expression: %s" % ex)
     else:
         parser.error("either -m or --mapping-expr must be given")
 
-    for infile in args:
-        remap_file(infile, mapper, options)
+    if options.jobs > 1:
+        remap_files_in_parallel(args, mapper, options)
+    else:
+        for infile in args:
+            remap_file(infile, mapper, options)
 
 
 if __name__ == "__main__":
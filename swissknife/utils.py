@@ -1,13 +1,19 @@
+from collections import deque
 from datetime import datetime
 from io import IOBase
+from itertools import chain, islice
+from operator import itemgetter
 
 import re
 
+# Regular expression that separates the two numbers of a size specification
+SIZE_SEPARATOR_REGEX = re.compile(r"[x;,]")
+
 
 def first(iterable):
-    """Returns the first element of the iterable."""
-    for item in iterable:
-        return item
+    """Returns the first element of the iterable, or ``None`` if it is
+    empty."""
+    return next(iter(iterable), None)
 
 
 def flatten(*args):
@@ -26,14 +32,22 @@ def flatten(*args):
         [2, 3, 4]
         >>> flatten([[2, 3], [4, 5], 6, [7, 8]])
         [2, 3, 4, 5, 6, 7, 8]
+        >>> flatten([[2, [3, [4]]], "ab", [], 5])
+        [2, 3, 4, 'ab', 5]
     """
-    if len(args) == 0:
-        return []
-    if len(args) > 1:
-        return flatten(list(args))
-    if hasattr(args[0], "__iter__") and not isinstance(args[0], str):
-        return sum(list(map(flatten, args[0])), [])
-    return list(args)
+    # Iterators of the lists being flattened, innermost last. This avoids
+    # both the recursion and the concatenation of partial results
+    result = []
+    stack = [iter(args)]
+    while stack:
+        for item in stack[-1]:
+            if hasattr(item, "__iter__") and not isinstance(item, (str, bytes)):
+                stack.append(iter(item))
+                break
+            result.append(item)
+        else:
+            stack.pop()
+    return result
 
 
 class TableWithHeaderIterator(object):
@@ -59,40 +73,230 @@ class TableWithHeaderIterator(object):
 
     def __iter__(self):
         chars_to_strip = " \t\r\n" if self.strip else "\r\n"
-        every = self.every
+        delimiter, every, fields = self.delimiter, self.every, self.fields
+        if fields:
+            select_fields = sublist_getter(fields)
 
-        line_number = 0
-        for line in self.fp:
-            parts = line.strip(chars_to_strip).split(self.delimiter)
-            if self.fields:
-                parts = sublist(parts, self.fields)
-            if not parts:
-                continue
-
-            if not self.first_column_is_date:
-                values = [lenient_float(num) for num in parts]
-            else:
-                values = [parts[0]] + [lenient_float(num) for num in parts[1:]]
+        def convert_numbers(parts):
+            # Convert the whole line in C first; cells are converted one by
+            # one only if some of them are not numbers
+            try:
+                return list(map(float, parts))
+            except ValueError:
+                return [lenient_float(num) for num in parts]
 
-            if not self.seen_header:
-                # No data yet, maybe this is the header?
-                if any(value is None for value in values):
-                    self.headers = parts
-                    self.seen_header = True
-                    continue
+        # Decide how to convert the parts of a line once and for all instead
+        # of checking it for every line
+        if self.first_column_is_date:
 
-            # This is a real data line. Decide whether to consider it or not.
-            if every <= 1 or line_number % every == 0:
-                yield values
+            def convert(parts):
+                return [parts[0]] + convert_numbers(parts[1:])
+
+        else:
+            convert = convert_numbers
+
+        # Split the lines and drop the empty ones lazily; everything below
+        # pulls the parts of the lines from this pipeline. split() without a
+        # delimiter ignores leading and trailing whitespace on its own, so the
+        # lines do not need to be stripped in that case
+        if delimiter is None:
+            rows = map(str.split, self.fp)
+        else:
+            rows = (line.strip(chars_to_strip).split(delimiter) for line in self.fp)
+        if fields:
+            rows = map(select_fields, rows)
+        rows = filter(None, rows)
+        line_number = 0
 
-            line_number += 1
+        if not self.seen_header:
+            # Only the first non-empty line may be the header, so we look at
+            # that line separately and then we never check for a header again
+            parts = next(rows, None)
+            if parts is None:
+                return
+
+            self.seen_header = True
+            values = convert(parts)
+            if any(value is None for value in values):
+                self.headers = list(parts)
+            else:
+                yield values
+                line_number += 1
+
+        # This is the data part. Lines that we are not going to consider are
+        # skipped by islice() without being converted at all
+        if every > 1:
+            rows = islice(rows, (every - line_number) % every, None, every)
+        yield from map(convert, rows)
+
+    def as_array(self, min_cols=0, pairs=False, min_width=0):
+        """Reads the remaining rows of the table into a single two-dimensional
+        NumPy array.
+
+        The number of columns is determined by the first row, but it is at
+        least `min_width`; shorter rows are padded and longer rows are
+        truncated. Missing values are
+        represented by NaNs. Rows with less than `min_cols` values are
+        skipped. When `pairs` is ``True``, rows with an odd number of values
+        are skipped as well.
+
+        Returns the array and the list of the values in the first column of
+        the table if it contains dates (``None`` otherwise). The first column
+        of the array is filled with NaNs in this case."""
+        from numpy import concatenate, empty
+
+        chunks = list(
+            self.iter_arrays(min_cols=min_cols, pairs=pairs, min_width=min_width)
+        )
+        if not chunks:
+            return empty((0, min_width)), [] if self.first_column_is_date else None
+        if len(chunks) == 1:
+            return chunks[0]
+
+        arrays, dates = zip(*chunks)
+        if self.first_column_is_date:
+            dates = list(chain.from_iterable(dates))
+        else:
+            dates = None
+        return concatenate(arrays), dates
+
+    def iter_arrays(self, chunksize=65536, min_cols=0, pairs=False, min_width=0):
+        """Reads the remaining rows of the table in chunks of at most
+        `chunksize` rows and yields each chunk as a two-dimensional NumPy
+        array. See `as_array()` for the meaning of `min_cols`, `pairs` and
+        `min_width`; the number of columns is determined by the first row of
+        the first chunk.
+
+        When the table is read from a stream with a single-character (or
+        whitespace) delimiter, without column selection or skipping rows,
+        the lines of each chunk are handed over to NumPy in one go. The rows
+        of a chunk are converted one by one only if NumPy cannot parse them,
+        e.g., because of missing values or rows of different lengths.
+
+        Yields tuples containing the array and the list of the values in the
+        first column of the chunk if the table contains dates (``None``
+        otherwise), just like `as_array()`."""
+        from numpy import empty, full, loadtxt, nan
+
+        def is_acceptable(values):
+            return len(values) >= min_cols and not (pairs and len(values) % 2)
+
+        def convert(rows):
+            # Converts the given rows one by one into an array; None values
+            # are converted to NaNs by NumPy and missing trailing values are
+            # already NaNs in the buffer
+            buf, num_rows = full((min(chunksize, 1024), num_cols), nan), 0
+            dates = [] if has_dates else None
+            for values in rows:
+                if num_rows == len(buf):
+                    # The buffer is full, double its capacity
+                    new_buf = full((2 * len(buf), num_cols), nan)
+                    new_buf[:num_rows] = buf
+                    buf = new_buf
+
+                if has_dates:
+                    dates.append(values[0])
+                    values[0] = None
+
+                num_values = min(len(values), num_cols)
+                buf[num_rows, :num_values] = values[:num_values]
+                num_rows += 1
+
+            return buf[:num_rows], dates
+
+        chunksize = max(1, int(chunksize))
+        has_dates = self.first_column_is_date
+
+        rows = filter(is_acceptable, iter(self))
+        values = next(rows, None)
+        if values is None:
+            return
+
+        # The first row determines the number of columns, unless the caller
+        # asked for more
+        first_cols = len(values)
+        num_cols = max(first_cols, min_width)
+
+        if (
+            has_dates
+            or self.every > 1
+            or self.fields
+            or (self.delimiter is not None and len(self.delimiter) != 1)
+            or not isinstance(self.fp, IOBase)
+        ):
+            rows = chain([values], rows)
+            while True:
+                chunk = convert(islice(rows, chunksize))
+                if not len(chunk[0]):
+                    return
+                yield chunk
+
+        # Try to parse the lines of each chunk with NumPy. This works only if
+        # all of them contain the same number of numeric values
+        fp, pending = self.fp, [values]
+        while True:
+            lines = list(islice(fp, chunksize - len(pending)))
+            if not lines and not pending:
+                return
+
+            try:
+                if not lines:
+                    rest = empty((0, first_cols))
+                elif any(map(str.strip, lines)):
+                    rest = loadtxt(
+                        lines, delimiter=self.delimiter, comments=None, ndmin=2
+                    )
+                else:
+                    # Blank lines only; NumPy would warn about the missing data
+                    rest = None
+            except ValueError:
+                rest = None
+
+            if rest is not None and rest.shape == (len(lines), first_cols):
+                if pending or num_cols > first_cols:
+                    result = full((len(pending) + len(lines), num_cols), nan)
+                    if pending:
+                        result[: len(pending), :first_cols] = pending
+                    result[len(pending) :, :first_cols] = rest
+                    rest = result
+                yield rest, None
+            else:
+                # NumPy could not parse the lines so we convert this chunk
+                # row by row
+                self.fp = lines
+                rest, _ = convert(chain(pending, filter(is_acceptable, iter(self))))
+                self.fp = fp
+                if len(rest):
+                    yield rest, None
+
+            pending = []
+
+    def to_columns(self, min_cols=0):
+        """Reads the remaining rows of the table and returns its columns as a
+        dictionary that maps the column headers to one-dimensional NumPy
+        arrays. Columns without a header are keyed by their one-based index
+        (as a string). The column containing dates, if any, is returned as a
+        list of strings. The arrays are contiguous, so they can be passed
+        directly to `mean()`, `mean_sd()` or `median()`."""
+        from numpy import asfortranarray
+
+        data, dates = self.as_array(min_cols)
+        data = asfortranarray(data)
+        headers = self.headers or []
+
+        result = {}
+        for idx in range(data.shape[1]):
+            key = headers[idx] if idx < len(headers) else str(idx + 1)
+            result[key] = dates if idx == 0 and dates is not None else data[:, idx]
+        return result
 
 
 def last(iterable):
-    """Returns the last element of the iterable."""
-    for item in iterable:
-        result = item
-    return result
+    """Returns the last element of the iterable, or ``None`` if it is
+    empty."""
+    # deque() consumes the iterable in C, keeping only the last element
+    items = deque(iterable, maxlen=1)
+    return items[0] if items else None
 
 
 def lenient_float(value, default=None):
@@ -110,8 +314,9 @@ def mask_nans(xs):
     from numpy import array, isnan
     from numpy.ma import masked_where
 
-    xs = [x if x is not None else NaN for x in xs]
-    xs = array(xs)
+    # NumPy converts None values to NaNs on its own when asked for floats,
+    # so there is no need to replace them in a separate pass
+    xs = array(xs, dtype=float)
     return masked_where(isnan(xs), xs)
 
 
@@ -123,9 +328,12 @@ def mean(items):
         >>> mean([5, 3, 7, 1, 9])
         5.0
     """
-    if not items:
+    from numpy import asarray
+
+    items = asarray(items, dtype=float)
+    if not items.size:
         return 0.0
-    return sum(items) / len(items)
+    return float(items.mean())
 
 
 def mean_95ci(items):
@@ -168,12 +376,13 @@ def mean_sd(items):
         >>> abs(sd - 3.162278) < 1e-5
         True
     """
-    m = mean(items)
-    if len(items) < 2:
-        return m, 0.0
+    from numpy import asarray
 
-    sqdiff = sum((item - m) ** 2 for item in items)
-    return m, (sqdiff / (len(items) - 1)) ** 0.5
+    items = asarray(items, dtype=float)
+    m = float(items.mean()) if items.size else 0.0
+    if items.size < 2:
+        return m, 0.0
+    return m, float(items.std(ddof=1))
 
 
 def median(items):
@@ -181,57 +390,71 @@ def median(items):
     middle elements. If `items` has an odd length, returns the single
     middle element. If `items` is empty, returns ``None``.
     """
-    n = len(items)
-    if not n:
+    from numpy import asarray, median
+
+    items = asarray(items, dtype=float)
+    if not items.size:
         return None
-    mid = n // 2
-    items = sorted(items)
-    if n % 2 == 0:
-        return (items[mid - 1] + items[mid]) / 2
-    return float(items[mid])
+    return float(median(items))
 
 
 def only_numbers(iterable):
     """Returns whether the given iterable contains numbers (or strings that
     can be converted into numbers) only."""
-    return not any(lenient_float(item) is None for item in iterable)
+    try:
+        # map() converts the items in C and stops at the first failure
+        list(map(float, iterable))
+    except ValueError:
+        return False
+    return True
 
 
 def open_anything(fname, *args, **kwds):
     """Opens the given file. The file may be given as a file object
     or a filename. If the filename ends in ``.bz2`` or ``.gz``, it will
-    automatically be decompressed on the fly. If the filename starts
+    automatically be decompressed on the fly; gzipped files are decompressed
+    with ``python-isal`` if it is installed. If the filename starts
     with ``http://``, ``https://`` or ``ftp://`` and there is no
-    other argument given, the remote URL will be opened for reading.
-    A single dash in place of the filename means the standard input.
+    other argument given (except the ``rb`` mode), the remote URL will
+    be opened for reading. A single dash in place of the filename means the
+    standard input; its underlying binary buffer is returned if the mode
+    given in the arguments is a binary mode.
     """
     if isinstance(fname, IOBase):
         infile = fname
     elif fname == "-" or fname is None:
         import sys
 
-        infile = sys.stdin
+        mode = args[0] if args else kwds.get("mode", "r")
+        infile = sys.stdin.buffer if "b" in mode else sys.stdin
     elif (
-        (
-            fname.startswith("http://")
-            or fname.startswith("ftp://")
-            or fname.startswith("https://")
-        )
+        fname.startswith(("http://", "https://", "ftp://"))
         and not kwds
-        and not args
+        and args in ((), ("rb",))
     ):
         import urllib.request, urllib.error, urllib.parse
 
         infile = urllib.request.urlopen(fname)
-    elif fname[-4:] == ".bz2":
+    elif fname.endswith(".bz2"):
         import bz2
 
         infile = bz2.BZ2File(fname, *args, **kwds)
-    elif fname[-3:] == ".gz":
-        import gzip
+    elif fname.endswith(".gz"):
+        try:
+            # python-isal decompresses considerably faster than the
+            # standard library, in a background thread, if it is installed
+            from isal.igzip_threaded import open as open_gzip
+        except ImportError:
+            from gzip import GzipFile as open_gzip
 
-        infile = gzip.GzipFile(fname, *args, **kwds)
+        infile = open_gzip(fname, *args, **kwds)
     else:
+        mode = args[0] if args else kwds.get("mode", "r")
+        if "b" in mode and len(args) < 2 and "buffering" not in kwds:
+            # Binary streams are read faster with a larger buffer than the
+            # default. Text streams do not benefit from it because they are
+            # decoded in small chunks anyway
+            kwds["buffering"] = 65536
         infile = open(fname, *args, **kwds)
     return infile
 
@@ -244,7 +467,16 @@ def parse_date(date_string, format="%Y-%m-%d", default=None, ordinal=False):
     Whenthe date cannot be parsed, the function will return the value of
     `default`. `format` specifies the date format to use."""
     try:
-        result = datetime.strptime(date_string, format)
+        if (
+            format == "%Y-%m-%d"
+            and len(date_string) == 10
+            and date_string[4] == date_string[7] == "-"
+        ):
+            # Shortcut for the default format; this is an order of magnitude
+            # faster than strptime()
+            result = datetime.fromisoformat(date_string)
+        else:
+            result = datetime.strptime(date_string, format)
     except (TypeError, ValueError):
         return default
     if ordinal:
@@ -257,12 +489,11 @@ def parse_index_specification(spec):
     and -F options."""
     result = []
     for part in spec.split(","):
-        part = part.strip()
-        if "-" in part:
-            lo, hi = list(map(int, part.split("-", 1)))
-            result.extend(range(lo, hi + 1))
+        lo, sep, hi = part.partition("-")
+        if sep:
+            result.extend(range(int(lo), int(hi) + 1))
         else:
-            result.append(int(part))
+            result.append(int(lo))
     return result
 
 
@@ -298,7 +529,7 @@ def parse_size_specification(spec, allow_units=True):
     if not spec:
         return None
 
-    parts = re.split("[x;,]", spec, maxsplit=1)
+    parts = SIZE_SEPARATOR_REGEX.split(spec, maxsplit=1)
     if not parts:
         return None
     if len(parts) > 2:
@@ -325,16 +556,30 @@ def sublist(l, idxs):
     return [l[i] for i in idxs]
 
 
+def sublist_getter(idxs):
+    """Returns a function that takes a list and returns a tuple containing
+    the items of the list with the given indices. Equivalent to calling
+    `sublist()` with the same indices, but the indexing is done in C.
+
+    Example::
+
+        >>> sublist_getter([2, 0])(["a", "b", "c"])
+        ('c', 'a')
+        >>> sublist_getter([1])(["a", "b", "c"])
+        ('b',)
+    """
+    if len(idxs) == 1:
+        getter = itemgetter(idxs[0])
+        return lambda l: (getter(l),)
+    return itemgetter(*idxs)
+
+
 def main_func(func):
     import sys
 
     def wrapped(*args, **kwds):
-        try:
-            sys.exit(func(*args, **kwds))
-        except Exception as ex:
-            import traceback
-
-            traceback.print_exc(file=sys.stderr)
-            sys.exit(1)
+        # Uncaught exceptions are printed to the standard error by the
+        # interpreter, which then exits with a status code of 1 anyway
+        sys.exit(func(*args, **kwds))
 
     return wrapped